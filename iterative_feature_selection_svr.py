@@ -1,110 +1,373 @@
 """
-Recursive Feature Elimination (RFE) with SVR for feature selection and model optimization.
+Linear SVR feature ranking (or optionally ridge-based RFE) for feature selection and model optimization.
 
 This script:
 - Loads a CSV dataset,
-- Iteratively applies RFE using SVR to select features,
-- Trains Linear Regression models on selected features,
+- Ranks all features by the coefficients of a single linear SVR (LIBLINEAR) fit,
+  or optionally with a single RFE pass ranking by ridge coefficients (solved in the dual,
+  kernel form while features outnumber samples),
+- Selects the top-ranked features for each feature count from the initial count down to the minimum,
+- Trains Linear Regression models on selected features in parallel; subsets clearly narrower
+  than the training split are solved from a Gram matrix computed once, wider or
+  ill-conditioned ones by least squares on the samples,
 - Tracks model performance metrics (R², RMSE, MAE, Explained Variance),
-- Stops when the minimum number of features is reached,
-- Saves the best-performing model and its selected features to a user-defined directory.
+- Stops early when R² stays below the best so far for a given number of iterations,
+- Saves the best-performing model, its selected features and the per-iteration metrics
+  to a user-defined directory.
 
 User inputs:
 - CSV file path,
-- RFE step size (how many features to remove at each RFE sub-step),
+- Optional JSON file of preselected feature names (as written by
+  rfe_linear_regression_feature_selection.py); only those columns and the target are read,
+- Whether to rank features with ridge-based RFE instead of a single linear SVR fit,
+- RFE step size (how many features to remove at each RFE sub-step; only asked for ridge RFE ranking),
 - Number of features to remove each iteration,
 - Minimum number of features to keep,
 - Directory to save outputs,
+- Early-stopping patience: how many iterations in a row may score an R² more than
+  `tol` (optimize_model argument, default 1e-4) below the best R² so far before
+  stopping; 0 runs down to the minimum number of features,
 - Whether to save the best model.
 
 """
 
 import os
+import json
+import math
+from concurrent.futures import ThreadPoolExecutor
 import pandas as pd
 import numpy as np
-from sklearn.svm import SVR
+from scipy.linalg import LinAlgError, cho_factor, cho_solve
+from sklearn.svm import LinearSVR
 from sklearn.linear_model import LinearRegression
-from sklearn.model_selection import train_test_split
-from sklearn.metrics import r2_score, mean_squared_error, mean_absolute_error, explained_variance_score
-from sklearn.feature_selection import RFE
-from joblib import dump
-
-def train_model(data):
-    X = data.iloc[:, :-1]
-    y = data.iloc[:, -1]
-
-    X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
-
+from joblib import Parallel, delayed, dump, effective_n_jobs
+
+METRIC_NAMES = ('R²', 'RMSE', 'MAE', 'Explained Variance')
+
+# Feature subsets are solved through the Gram matrix only when they have at most
+# this many features per training sample; wider subsets make X'X huge and
+# rank-deficient, so they are fitted on the samples instead.
+GRAM_MAX_FEATURE_RATIO = 0.5
+
+# Smallest reciprocal condition number of a Gram sub-block accepted from the
+# Cholesky factor before falling back to a least-squares fit on the samples.
+GRAM_MIN_RCOND = 1e-10
+
+def normal_equations(X, y, columns):
+    # Accumulate in float64: the Gram matrix squares the condition number of X
+    X_subset = X[:, columns]
+    X_mean = X_subset.mean(axis=0, dtype=np.float64)
+    y_mean = y.mean(dtype=np.float64)
+    X_centered = X_subset - X_mean
+
+    return X_centered.T @ X_centered, X_centered.T @ (y - y_mean), X_mean, y_mean, columns
+
+def solve_gram(train_stats, columns):
+    gram, moment, X_mean, y_mean, gram_columns = train_stats
+
+    # Both column arrays are sorted; the subset must lie inside the Gram columns
+    positions = np.searchsorted(gram_columns, columns)
+    if positions.max() >= len(gram_columns) or not np.array_equal(gram_columns[positions], columns):
+        return None
+
+    # Centering the data makes the sub-block of the Gram matrix the normal
+    # equations of the subset, so no pass over the samples is needed here.
+    try:
+        factor, lower = cho_factor(gram[np.ix_(positions, positions)])
+    except LinAlgError:
+        return None
+
+    # The Cholesky diagonal bounds the conditioning of the sub-block from below;
+    # reject nearly collinear subsets instead of returning meaningless coefficients.
+    diagonal = np.abs(np.diag(factor))
+    if (diagonal.min() / diagonal.max()) ** 2 < GRAM_MIN_RCOND:
+        return None
+
+    coef = cho_solve((factor, lower), moment[positions])
+    intercept = y_mean - X_mean[positions] @ coef
+
+    return coef, intercept
+
+def fit_subset(X, y, columns, train_stats=None):
+    solution = solve_gram(train_stats, columns) if train_stats is not None else None
+    if solution is not None:
+        return solution
+
+    # Wide or ill-conditioned subsets: SVD-based least squares on the samples,
+    # which gives LinearRegression's minimum-norm solution
+    model = LinearRegression(copy_X=False).fit(X[:, columns], y)
+
+    return model.coef_, model.intercept_
+
+def to_estimator(coef, intercept, feature_names):
+    # Wrap solved coefficients in a fitted LinearRegression so the saved model
+    # keeps the same predict() interface and feature-name checks. Only the
+    # attributes predict() needs are set: rank_ and singular_ come from the SVD
+    # in LinearRegression.fit and are absent on models built here.
     model = LinearRegression()
-    model.fit(X_train, y_train)
-
-    y_pred = model.predict(X_test)
-
-    metrics = {
-        'R²': r2_score(y_test, y_pred),
-        'RMSE': np.sqrt(mean_squared_error(y_test, y_pred)),
-        'MAE': mean_absolute_error(y_test, y_pred),
-        'Explained Variance': explained_variance_score(y_test, y_pred)
+    model.coef_ = coef
+    model.intercept_ = intercept
+    model.n_features_in_ = len(feature_names)
+    model.feature_names_in_ = feature_names
+
+    return model
+
+def finite_score(numerator, denominator):
+    # Same as sklearn's force_finite=True: a constant target scores 1.0 when it
+    # is predicted exactly and 0.0 otherwise, instead of nan or -inf.
+    if denominator == 0:
+        return 1.0 if numerator == 0 else 0.0
+
+    return float(1 - numerator / denominator)
+
+def regression_metrics(y_true, y_pred):
+    # Every metric is derived from one residual vector, so the test targets and
+    # predictions are traversed once instead of once per sklearn metric.
+    residual = y_true - y_pred
+    residual_centered = residual - residual.mean()
+    y_centered = y_true - y_true.mean(dtype=np.float64)
+
+    ss_res = residual @ residual
+    ss_res_centered = residual_centered @ residual_centered
+    ss_tot = y_centered @ y_centered
+
+    return {
+        'R²': finite_score(ss_res, ss_tot),
+        'RMSE': float(np.sqrt(ss_res / len(residual))),
+        'MAE': float(np.abs(residual).mean()),
+        'Explained Variance': finite_score(ss_res_centered, ss_tot)
     }
 
-    return model, metrics
-
-def feature_selection(data, step, remove_count):
-    X = data.iloc[:, :-1]
-    y = data.iloc[:, -1]
-
-    svr = SVR(kernel='linear')
-    n_features = X.shape[1] - remove_count
-    if n_features < 1:
-        n_features = 1  # Ensure at least one feature remains
-
-    rfe = RFE(estimator=svr, step=step, n_features_to_select=n_features)
-    rfe.fit(X, y)
-
-    selected_features = X.columns[rfe.support_]
-    X_selected = X.loc[:, selected_features]
-
-    final_data = X_selected.copy()
-    final_data['target'] = y
+def train_model(X_train, y_train, X_test, y_test, columns, train_stats=None):
+    coef, intercept = fit_subset(X_train, y_train, columns, train_stats)
+
+    y_pred = X_test[:, columns] @ coef + intercept
+
+    metrics = regression_metrics(y_test, y_pred)
+
+    return (coef, intercept), metrics
+
+def ridge_rfe_ranking(X, y, step, n_features, alpha=1.0):
+    # Follows RFE's elimination schedule, but ranks by ridge coefficients instead
+    # of refitting an estimator at every step. Unlike RFE's ranking_, features
+    # removed in the same step get distinct ranks (the weakest the highest), so
+    # the top features for any count above n_features are well defined. While
+    # features outnumber samples the dual form solves an n x n kernel that is
+    # downdated as columns drop out; after that one Gram matrix over the
+    # survivors serves every remaining step. The penalty is alpha times the mean
+    # diagonal of the Gram matrix (trace(X'X) = trace(XX')), so it does not depend
+    # on the number of samples or the units of the features.
+    if step <= 0:
+        raise ValueError("step must be greater than 0.")
+
+    X_centered = X - X.mean(axis=0, dtype=np.float64)
+    y_centered = y - y.mean(dtype=np.float64)
+    n_samples = len(y)
+
+    support = np.ones(X.shape[1], dtype=bool)
+    eliminated = []  # In elimination order, weakest first within each step
+    kernel = None
+    gram = None
+
+    while support.sum() > n_features:
+        features = np.flatnonzero(support)
+
+        if len(features) > n_samples:
+            if kernel is None:
+                kernel = X_centered[:, features] @ X_centered[:, features].T
+            penalty = alpha * np.trace(kernel) / len(features)
+            dual = cho_solve(cho_factor(kernel + penalty * np.eye(n_samples)), y_centered)
+            coef = dual @ X_centered[:, features]
+        else:
+            if gram is None:
+                gram_features = features
+                X_survivors = X_centered[:, features]
+                gram = X_survivors.T @ X_survivors
+                moment = X_survivors.T @ y_centered
+            positions = np.searchsorted(gram_features, features)
+            sub_gram = gram[np.ix_(positions, positions)]
+            penalty = alpha * np.trace(sub_gram) / len(features)
+            coef = cho_solve(cho_factor(sub_gram + penalty * np.eye(len(features))), moment[positions])
+
+        n_remove = min(step, len(features) - n_features)
+        removed = features[np.argsort(np.abs(coef), kind='stable')[:n_remove]]
+        support[removed] = False
+        eliminated.extend(removed)
+
+        if gram is None:
+            kernel -= X_centered[:, removed] @ X_centered[:, removed].T
+
+    # Survivors share rank 1; the last feature eliminated is ranked 2
+    ranking = np.ones(X.shape[1], dtype=int)
+    ranking[eliminated[::-1]] = np.arange(2, len(eliminated) + 2)
+
+    return ranking
+
+def feature_selection(X, y, step, n_features, iterative=False):
+    n_features = max(n_features, 1)  # Ensure at least one feature remains
+
+    if iterative:
+        # Ridge and linear SVR coefficients rank features nearly identically for
+        # elimination purposes, and ridge solves avoid refitting on the samples.
+        return ridge_rfe_ranking(X, y, step, n_features)
+
+    # A linear model ranks every feature by |coef_| after a single fit
+    svr = LinearSVR(C=1.0, dual='auto', max_iter=5000, random_state=42)
+    svr.fit(X, y)
+    ranking = np.empty(X.shape[1], dtype=int)
+    ranking[np.argsort(-np.abs(svr.coef_), kind='stable')] = np.arange(1, X.shape[1] + 1)
+
+    return ranking
+
+def top_features(ranking, n_features):
+    # Lower rank means the feature survived elimination longer. Both rankings
+    # give distinct ranks to every eliminated feature, so a top set is never
+    # chosen by column position; refuse a cutoff that falls inside a tie.
+    order = np.argsort(ranking, kind='stable')
+    if n_features < len(ranking) and ranking[order[n_features - 1]] == ranking[order[n_features]]:
+        raise ValueError(f"Feature ranking is tied at {n_features} features; the top features are ambiguous.")
+
+    return np.sort(order[:n_features])
+
+def optimize_model(file_path, step, remove_count, min_features, save_dir, preselected_cols=None,
+                   iterative_ranking=False, patience=0, tol=1e-4, n_jobs=-1):
+    if remove_count < 1:
+        raise ValueError("remove_count must be at least 1.")
+    if patience < 0:
+        raise ValueError("patience must be 0 or greater.")
 
-    return final_data, selected_features
-
-def optimize_model(file_path, step, remove_count, min_features, save_dir):
     if not os.path.exists(file_path):
         print(f"File '{file_path}' not found.")
         return
 
-    data = pd.read_csv(file_path)
-    models_metrics = []
-    initial_features = data.shape[1] - 1
-
-    print(f"Initial features count: {initial_features}")
-    print("Training initial model...")
-    initial_model, initial_metrics = train_model(data)
-    models_metrics.append(("initial_model", initial_metrics, data))
-
-    iteration = 1
-    current_features = initial_features
+    usecols = None
+    if preselected_cols:
+        if not os.path.exists(preselected_cols):
+            print(f"File '{preselected_cols}' not found.")
+            return
 
-    while True:
-        print(f"\nFeature selection iteration {iteration}...")
+        with open(preselected_cols) as f:
+            selected_columns = json.load(f)
 
-        if current_features <= min_features:
-            print(f"Reached minimum number of features ({min_features}). Stopping.")
-            break
+        # The target is the last column of the CSV; only the header is read here
+        target_col = pd.read_csv(file_path, nrows=0).columns[-1]
+        usecols = selected_columns + [target_col]
 
-        data, selected_features = feature_selection(data, step, remove_count)
-        current_features = len(selected_features)
-        print(f"Selected features ({current_features}): {selected_features.tolist()}")
+    data = pd.read_csv(file_path, usecols=usecols, dtype=np.float32, engine='pyarrow')
+    initial_features = data.shape[1] - 1
 
-        print(f"Training model iteration {iteration}...")
-        model, metrics = train_model(data)
-        models_metrics.append((f"model_iteration_{iteration}", metrics, data))
+    # Work on one contiguous float32 copy of the data and refer to feature
+    # subsets by column index instead of slicing DataFrames.
+    X = data.iloc[:, :-1].to_numpy(dtype=np.float32, copy=True)
+    y = data.iloc[:, -1].to_numpy(dtype=np.float32)
+    feature_names = np.array(data.columns[:-1])
+    del data
+
+    # Split by row index once and gather each side once
+    perm = np.random.default_rng(42).permutation(len(y))
+    n_test = math.ceil(0.2 * len(y))  # Rounded up like train_test_split
+    test_idx, train_idx = perm[:n_test], perm[n_test:]
+    X_train, y_train = X[train_idx], y[train_idx]
+    X_test, y_test = X[test_idx], y[test_idx]
+
+    sizes = list(range(initial_features - remove_count, max(min_features, 1) - 1, -remove_count))
+    if not sizes:
+        print(f"Removing {remove_count} of {initial_features} features would go below the minimum "
+              f"({min_features}); only the initial model is trained.")
+
+    # One metrics row per model (initial model first), in METRIC_NAMES order.
+    # Only the feature count is kept per model: its columns are the top of the
+    # ranking, so just the best model's columns are rebuilt at the end.
+    model_names = []
+    model_n_features = []
+    metrics_arr = np.empty((len(sizes) + 1, len(METRIC_NAMES)), dtype=np.float64)
 
-        iteration += 1
+    print(f"Initial features count: {initial_features}")
 
-    best_model = max(models_metrics, key=lambda x: x[1]['R²'])
-    best_model_name, best_metrics, best_data = best_model
+    if sizes:
+        # One ranking of every feature yields the selection for each feature
+        # count: either a single LinearSVR fit, or one ridge RFE pass down to
+        # the smallest count when features should be re-ranked as others drop out.
+        if iterative_ranking:
+            print(f"\nRanking features with ridge RFE down to {sizes[-1]} features...")
+        else:
+            print("\nRanking features with a single LinearSVR fit...")
+        ranking = feature_selection(X, y, step, sizes[-1], iterative=iterative_ranking)
+
+    # The Gram matrix only covers subsets clearly narrower than the training set.
+    # Subsets are nested tops of the ranking, so one Gram over the largest such
+    # subset serves every smaller one; wider subsets are fitted on the samples.
+    n_gram = int(GRAM_MAX_FEATURE_RATIO * len(y_train))
+    if initial_features <= n_gram:
+        gram_columns = np.arange(initial_features)
+    elif sizes and n_gram >= sizes[-1]:
+        # Only worth building when it covers the smallest subset; a narrower cut
+        # would serve no fit and could fall inside the tied final survivors
+        gram_columns = top_features(ranking, n_gram)
+    else:
+        gram_columns = None
+    train_stats = normal_equations(X_train, y_train, gram_columns) if gram_columns is not None else None
+
+    print("\nTraining initial model...")
+    columns = np.arange(initial_features)
+    initial_model, initial_metrics = train_model(X_train, y_train, X_test, y_test, columns, train_stats)
+    metrics_arr[0] = [initial_metrics[name] for name in METRIC_NAMES]
+    model_names.append("initial_model")
+    model_n_features.append(initial_features)
+
+    best_r2 = initial_metrics['R²']
+    no_improve_count = 0
+    stop = False
+
+    # Every subset comes from the same ranking, so the fits for the whole
+    # schedule are independent. Threads share the Gram matrix without copies;
+    # running one fit per worker per batch keeps early stopping possible and
+    # only one batch of column subsets in memory.
+    batch_size = effective_n_jobs(n_jobs)
+
+    with Parallel(n_jobs=n_jobs, prefer='threads') as parallel:
+        for start in range(0, len(sizes), batch_size):
+            batch = sizes[start:start + batch_size]
+            batch_columns = [top_features(ranking, n_features) for n_features in batch]
+            results = parallel(
+                delayed(train_model)(X_train, y_train, X_test, y_test, columns, train_stats)
+                for columns in batch_columns
+            )
+
+            for iteration, n_features, columns, (model, metrics) in zip(
+                range(start + 1, start + len(batch) + 1), batch, batch_columns, results
+            ):
+                print(f"\nFeature selection iteration {iteration}...")
+                print(f"Selected features ({len(columns)}): {feature_names[columns].tolist()}")
+
+                metrics_arr[iteration] = [metrics[name] for name in METRIC_NAMES]
+                model_names.append(f"model_iteration_{iteration}")
+                model_n_features.append(n_features)
+
+                # Stop early once R² has stayed below the best so far for `patience` iterations
+                if metrics['R²'] < best_r2 - tol:
+                    no_improve_count += 1
+                else:
+                    no_improve_count = 0
+                best_r2 = max(best_r2, metrics['R²'])
+
+                if patience and no_improve_count >= patience:
+                    print(f"R² has not recovered for {patience} iterations. Stopping.")
+                    stop = True
+                    break
+
+            if stop:
+                break
+
+    # Highest R² wins; ties are broken by the lowest RMSE
+    n_done = len(model_names)
+    best_i = int(np.lexsort((metrics_arr[:n_done, 1], -metrics_arr[:n_done, 0]))[0])
+    best_model_name = model_names[best_i]
+    best_metrics = dict(zip(METRIC_NAMES, metrics_arr[best_i].tolist()))
+    if best_i == 0:
+        best_columns = np.arange(initial_features)
+    else:
+        best_columns = top_features(ranking, model_n_features[best_i])
 
     print("\nBest model found:")
     print(f"Model name: {best_model_name}")
@@ -115,22 +378,66 @@ def optimize_model(file_path, step, remove_count, min_features, save_dir):
 
     best_model_file = os.path.join(save_dir, f"best_model_{best_model_name}.joblib")
     best_features_file = os.path.join(save_dir, f"best_features_{best_model_name}.csv")
+    metrics_file = os.path.join(save_dir, "iteration_metrics.npz")
+
+    np.savez(
+        metrics_file,
+        model_names=np.array(model_names),
+        n_features=np.array(model_n_features),
+        metric_names=np.array(METRIC_NAMES),
+        metrics=metrics_arr[:n_done]
+    )
+    print(f"Per-iteration metrics saved to {metrics_file}")
+
+    # Refit the best subset on all samples. Narrow subsets reuse the guarded
+    # normal-equation solve; wide or ill-conditioned ones need an SVD anyway, so
+    # they get a regular LinearRegression fit (copying X, since best_X is saved below).
+    best_X = X[:, best_columns]
+    best_feature_names = feature_names[best_columns]
+    solution = None
+    if len(best_columns) <= GRAM_MAX_FEATURE_RATIO * len(y):
+        all_columns = np.arange(len(best_columns))
+        solution = solve_gram(normal_equations(best_X, y, all_columns), all_columns)
+
+    if solution is not None:
+        final_model = to_estimator(*solution, best_feature_names)
+    else:
+        final_model = LinearRegression().fit(pd.DataFrame(best_X, columns=best_feature_names), y)
+
+    best_data = pd.DataFrame(best_X, columns=best_feature_names).assign(target=y)
+
+    # Write the outputs in the background while waiting for the user's answer;
+    # the model goes to a temporary file that is kept or discarded afterwards.
+    tmp_model_file = best_model_file + '.tmp'
+    try:
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            pending_model = executor.submit(dump, final_model, tmp_model_file, protocol=5)
+            pending_features = executor.submit(best_data.to_csv, best_features_file, index=False)
+
+            save_model = input("Do you want to save the best model? (yes/no): ").strip().lower()
+            pending_model.result()
+            pending_features.result()
+
+        if save_model in ('yes', 'y'):
+            os.replace(tmp_model_file, best_model_file)
+            print(f"Best model saved to {best_model_file}")
+    finally:
+        # Discard the temporary model on "no", on errors and on an interrupted prompt
+        if os.path.exists(tmp_model_file):
+            os.remove(tmp_model_file)
 
-    final_model = LinearRegression().fit(best_data.iloc[:, :-1], best_data.iloc[:, -1])
-
-    save_model = input("Do you want to save the best model? (yes/no): ").strip().lower()
-    if save_model in ('yes', 'y'):
-        dump(final_model, best_model_file)
-        print(f"Best model saved to {best_model_file}")
-
-    best_data.to_csv(best_features_file, index=False)
     print(f"Best features saved to {best_features_file}")
 
 if __name__ == "__main__":
     file_path = input("Enter the CSV file path: ").strip()
-    step = int(input("Enter RFE step (features to remove each RFE sub-step): ").strip())
+    preselected_cols = input("Enter the selected features JSON path (leave empty to use all features): ").strip()
+    iterative_ranking = input("Rank features with ridge-based RFE instead of a single linear SVR fit? (yes/no): ").strip().lower() in ('yes', 'y')
+    step = 1  # Only used by ridge RFE ranking
+    if iterative_ranking:
+        step = int(input("Enter RFE step (features to remove each RFE sub-step): ").strip())
     remove_count = int(input("Enter how many features to remove each iteration: ").strip())
     min_features = int(input("Enter the minimum number of features to keep: ").strip())
     save_dir = input("Enter directory path to save results: ").strip()
+    patience = int(input("Enter how many iterations with R² more than 1e-4 below the best to allow before stopping (0 to disable): ").strip())
 
-    optimize_model(file_path, step, remove_count, min_features, save_dir)
+    optimize_model(file_path, step, remove_count, min_features, save_dir, preselected_cols, iterative_ranking, patience)
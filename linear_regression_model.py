@@ -25,8 +25,8 @@ if not os.path.exists(file_path):
     print(f"The file at '{file_path}' was not found. Please check the path and try again.")
     exit()
 
-# Load dataset (assuming CSV format)
-data = pd.read_csv(file_path)
+# Load dataset (assuming CSV format) as float32 with the pyarrow CSV reader
+data = pd.read_csv(file_path, dtype=np.float32, engine='pyarrow')
 
 # Split features (X) and target variable (y)
 X = data.iloc[:, :-1]  # All columns except the last
@@ -38,7 +38,8 @@ X_train, X_test, y_train, y_test = train_test_split(
 )
 
 # Create and train Linear Regression model
-lr_model = LinearRegression()
+# copy_X=False lets the fit center X_train in place; X_train is not used afterwards
+lr_model = LinearRegression(copy_X=False)
 lr_model.fit(X_train, y_train)
 
 # Predict test set results
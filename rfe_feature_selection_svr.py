@@ -4,6 +4,7 @@ using an SVR model to select the best features,
 and saves the resulting dataset with only the selected features and target variable.
 """
 
+import numpy as np
 import pandas as pd
 from sklearn.feature_selection import RFE
 from sklearn.svm import SVR
@@ -11,8 +12,8 @@ from sklearn.svm import SVR
 # Prompt for file path
 file_path = input("Enter the CSV file path: ").strip()
 
-# Load dataset
-data = pd.read_csv(file_path)
+# Load dataset as float32 with the pyarrow CSV reader
+data = pd.read_csv(file_path, dtype=np.float32, engine='pyarrow')
 
 # Split features (X) and target variable (y)
 X = data.iloc[:, :-1]  # All columns except the last
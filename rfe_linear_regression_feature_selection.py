@@ -2,8 +2,13 @@
 This script loads a CSV dataset, applies Recursive Feature Elimination (RFE)
 using a Linear Regression model to select the best features, 
 and saves the resulting dataset with only the selected features and target variable.
+The selected feature names are also saved to a JSON file next to the new CSV file,
+so later runs can load only those columns.
 """
 
+import os
+import json
+import numpy as np
 import pandas as pd
 from sklearn.feature_selection import RFE
 from sklearn.linear_model import LinearRegression
@@ -11,15 +16,16 @@ from sklearn.linear_model import LinearRegression
 # Prompt for file path
 file_path = input("Enter the CSV file path: ").strip()
 
-# Load dataset
-data = pd.read_csv(file_path)
+# Load dataset as float32 with the pyarrow CSV reader
+data = pd.read_csv(file_path, dtype=np.float32, engine='pyarrow')
 
 # Split features (X) and target variable (y)
 X = data.iloc[:, :-1]  # All columns except the last
 y = data.iloc[:, -1]   # Last column as target
 
 # Create the regression model
-model = LinearRegression()
+# RFE fits it on a fresh column subset each step, so X need not be copied again
+model = LinearRegression(copy_X=False)
 
 # Create RFE object and select top 32 features
 rfe = RFE(estimator=model, n_features_to_select=32, step=1)
@@ -43,3 +49,10 @@ save_path = input("Enter the path to save the new CSV file: ").strip()
 final_data.to_csv(save_path, index=False)
 
 print(f"File saved successfully at: {save_path}")
+
+# Save selected feature names alongside the new CSV file
+features_path = os.path.splitext(save_path)[0] + '_features.json'
+with open(features_path, 'w') as f:
+    json.dump(list(selected_features), f)
+
+print(f"Selected feature names saved at: {features_path}")